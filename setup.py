@@ -53,7 +53,20 @@ classifiers = [
 package_dir = {"": "src"}
 
 
-is_lib3to6_fix_required = any(arg.startswith("bdist") for arg in sys.argv)
+# Opt-in: compile the hot modules to C extensions using mypyc. The
+# pure python modules are used if the package is installed without.
+is_mypyc_build = os.environ.get("PYLINT_IGNORE_USE_MYPYC") == "1"
+
+ext_modules = []
+
+if is_mypyc_build:
+    from mypyc.build import mypycify
+    ext_modules = mypycify(["src/pylint_ignore/ignorefile.py"])
+
+
+is_lib3to6_fix_required = not is_mypyc_build and any(
+    arg.startswith("bdist") for arg in sys.argv
+)
 
 if is_lib3to6_fix_required:
     try:
@@ -82,6 +95,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     packages=setuptools.find_packages("src/"),
     package_dir=package_dir,
+    ext_modules=ext_modules,
     install_requires=install_requires,
     entry_points="""
         [console_scripts]
@@ -3,7 +3,11 @@
 #
 # Copyright (c) 2020 Manuel Barkhau (mbarkhau@gmail.com) - MIT License
 # SPDX-License-Identifier: MIT
+import io
+import os
 import re
+import array
+import bisect
 import shutil
 import typing as typ
 import hashlib
@@ -13,6 +17,28 @@ import collections
 import pylev
 import pathlib2 as pl
 
+# NOTE: pylev is always installed as the fallback for when rapidfuzz>=3.0
+#   is not available (python<3.7) or not importable.
+try:
+    from rapidfuzz import process as _rf_process
+    from rapidfuzz.distance import Levenshtein as _rf_levenshtein
+
+    HAS_RAPIDFUZZ = True
+except ImportError:
+    HAS_RAPIDFUZZ = False
+
+try:
+    from mypy_extensions import mypyc_attr
+except ImportError:
+    # NOTE: No-op fallback for when mypy_extensions is not installed,
+    #   the attributes only have an effect when compiling with mypyc.
+
+    _T = typ.TypeVar('_T')
+
+    def mypyc_attr(*_args: str, **_kwargs: object) -> typ.Callable[[_T], _T]:
+        return lambda cls: cls
+
+
 logger = logging.getLogger('pylint_ignore')
 
 
@@ -70,38 +96,111 @@ $
 ENTRY_HEADER_RE = re.compile(_ENTRY_HEADER_PATTERN, flags=re.VERBOSE)
 
 
-# https://regex101.com/r/6JViif/5
-_LIST_ITEM_PATTERN = r"""
-^
-\s*-\s
-`
-(?P<key>message|author|date)
-\s*:\s
-(?P<value>.*)
-`
-$
-"""
+LIST_ITEM_KEYS = {'message', 'author', 'date'}
 
-LIST_ITEM_RE = re.compile(_LIST_ITEM_PATTERN, flags=re.VERBOSE)
 
+def _parse_list_item(line: str) -> typ.Optional[typ.Tuple[str, str]]:
+    """Parse a list item line of the form "- `key: value`".
 
-# https://regex101.com/r/Cc8w4v/5
-_SOURCE_TEXT_PATTERN = r"""
-(```|~~~)(?P<language>\w+)?
-    (
-        (?:\s+(?P<def_lineno>\d+):\s(?P<def_line>.*))?
-        \s+\.\.\.
-    )?
-    (?:\s+\d+:\s?.*)?
-    (?:\s+\d+:\s?.*)?
-    \s*\>\s+(?P<source_lineno>\d+):\s(?P<source_line>.*)
-    (?:\s+\d+:\s?.*)?
-    (?:\s+\d+:\s?.*)?
-    \s*
-(```|~~~)
-"""
+    >>> _parse_list_item("- `author : Manuel Barkhau <mbarkhau@gmail.com>`")
+    ('author', 'Manuel Barkhau <mbarkhau@gmail.com>')
+    >>> _parse_list_item("- `message: Undefined variable 'Entry'`\\n")
+    ('message', "Undefined variable 'Entry'")
+    >>> _parse_list_item("- `lineno: 12`") is None
+    True
+    """
+    item = line.strip()
+    if not (item.startswith("- `") and item.endswith("`")):
+        return None
+
+    key, sep, value = item[3:-1].partition(":")
+    key = key.rstrip()
+    if not (sep and key in LIST_ITEM_KEYS and value[:1].isspace()):
+        return None
+
+    return (key, value[1:])
+
+
+# Fields of the code block of an entry: source_lineno, source_line
+# and, if the block starts with the def/class of the source line,
+# def_lineno and def_line.
+CtxSrcFields = typ.Dict[str, str]
+
+FENCES = ("```", "~~~")
+
+# (is_source_line, lineno, text)
+CtxLine = typ.Tuple[bool, str, str]
+
+
+def _parse_ctx_line(content: str) -> typ.Optional[CtxLine]:
+    """Parse a line of the form "[>] <lineno>: <text>".
+
+    >>> _parse_ctx_line(">  12: x = 1")
+    (True, '12', 'x = 1')
+    >>> _parse_ctx_line("x = 1") is None
+    True
+    """
+    is_source_line = content.startswith(">")
+    if is_source_line:
+        content = content[1:].lstrip()
+
+    lineno, sep, text = content.partition(":")
+    if not (sep and lineno.isdigit()):
+        return None
+
+    # strip the space between the lineno and the line
+    if text[:1].isspace():
+        text = text[1:]
+
+    return (is_source_line, lineno, text)
+
+
+def _parse_ctx_src_text_fields(ctx_src_text: str) -> typ.Optional[CtxSrcFields]:
+    """Parse the code block of an entry with the context of a source line.
+
+    Returns None if the code block is something else (such as the
+    extra message text of a duplicate-code message).
+
+    >>> fields = _parse_ctx_src_text_fields("```\\n  1: x = 1\\n> 2: y = 2\\n```\\n")
+    >>> fields['source_lineno'], fields['source_line']
+    ('2', 'y = 2')
+    """
+    lines = ctx_src_text.strip().split("\n")
+    if len(lines) < 3 or lines[0][:3] not in FENCES or lines[-1].strip() not in FENCES:
+        return None
 
-SOURCE_TEXT_RE = re.compile(_SOURCE_TEXT_PATTERN, flags=re.VERBOSE)
+    fields   : CtxSrcFields = {}
+    ctx_lines: typ.List[typ.Tuple[str, str]] = []
+    for line in lines[1:-1]:
+        content = line.lstrip()
+        if not content:
+            continue
+
+        if content == "...":
+            if len(ctx_lines) == 1 and not fields:
+                fields['def_lineno'], fields['def_line'] = ctx_lines[0]
+            continue
+
+        ctx_line = _parse_ctx_line(content)
+        if ctx_line is None:
+            return None
+
+        is_source_line, lineno, text = ctx_line
+        if is_source_line:
+            if 'source_line' in fields:
+                return None
+            fields['source_lineno'] = lineno
+            fields['source_line'  ] = text
+
+        ctx_lines.append((lineno, text))
+
+    if 'source_line' in fields:
+        return fields
+    else:
+        return None
+
+
+SourceLines = typ.Tuple[str, ...]
 
 
 class SourceText(typ.NamedTuple):
@@ -110,6 +209,7 @@ class SourceText(typ.NamedTuple):
     old_lineno  : int
     source_line : str
     text        : str
+    src_lines   : SourceLines  # lines of text, without line endings
     start_idx   : int
     end_idx     : int
     def_line_idx: typ.Optional[int]
@@ -151,38 +251,212 @@ class ObsoleteEntry(Exception):
     pass
 
 
-Catalog = typ.Dict[Key, Entry]
+# The fields of a Key which must be equal for a fuzzy match: (msgid, path, symbol)
+KeyGroup = typ.Tuple[str, str, str]
+
+
+def _key_group(key: Key) -> KeyGroup:
+    return (key.msgid, key.path, key.symbol)
+
+
+# (msg_text, source_line) of a Key, as compared by a fuzzy match
+NormStrs = typ.Tuple[str, str]
+
+
+def _norm_strs(key: Key) -> NormStrs:
+    """Normalize the fuzzy matched fields of a key.
+
+    Surrounding whitespace would otherwise count as edits and inflate
+    the lengths used for the percentage thresholds. Indentation of the
+    source_line is kept, as it is significant.
+
+    >>> _norm_strs(Key("W0101", "a.py", "sym", " Bad thing ", "    x = 1  "))
+    ('Bad thing', '    x = 1')
+    """
+    return (key.msg_text.strip(), key.source_line.rstrip())
+
+
+# NOTE: mypyc doesn't support native classes derived from OrderedDict
+@mypyc_attr(native_class=False)
+class Catalog(collections.OrderedDict):
+    """Mapping of Key -> Entry.
+
+    Keys are additionally indexed by their KeyGroup, so that candidates
+    for a fuzzy match can be looked up without a scan of all keys.
+    The normalized strings of each key are computed once, when it is
+    added, rather than for every fuzzy match.
+    """
+
+    _keys_by_group: typ.Dict[KeyGroup, typ.List[Key]]
+    _norm_strs_by_key: typ.Dict[Key, NormStrs]
+
+    def __init__(self, *args: typ.Any, **kwargs: typ.Any) -> None:
+        # NOTE: The index must exist before any items are added
+        #   via OrderedDict.__init__ -> Catalog.__setitem__
+        self._keys_by_group = collections.defaultdict(list)
+        self._norm_strs_by_key = {}
+        collections.OrderedDict.__init__(self, *args, **kwargs)
+
+    def __eq__(self, other: typ.Any) -> bool:
+        # NOTE: The order of entries is not significant, it is
+        #   determined when the catalog is written (see dumps).
+        return dict.__eq__(self, other) is True
+
+    def __ne__(self, other: typ.Any) -> bool:
+        return not self == other
+
+    __hash__ = None  # type: ignore
+
+    def _unindex(self, key: Key) -> None:
+        group      = _key_group(key)
+        group_keys = self._keys_by_group[group]
+        group_keys.remove(key)
+        if not group_keys:
+            del self._keys_by_group[group]
+        del self._norm_strs_by_key[key]
+
+    def __setitem__(self, key: Key, entry: Entry) -> None:
+        num_keys = len(self)
+        collections.OrderedDict.__setitem__(self, key, entry)
+        is_new_key = len(self) > num_keys
+        if is_new_key:
+            self._keys_by_group[_key_group(key)].append(key)
+            self._norm_strs_by_key[key] = _norm_strs(key)
+
+    def __delitem__(self, key: Key) -> None:
+        collections.OrderedDict.__delitem__(self, key)
+        self._unindex(key)
+
+    # NOTE: Whether OrderedDict.pop/popitem delegate to __delitem__
+    #   depends on the implementation (py27 does, the C version of py3
+    #   doesn't), so they are implemented here only in terms of it.
+
+    def pop(self, key: Key, *default: typ.Any) -> typ.Any:
+        if key in self:
+            entry = self[key]
+            del self[key]
+            return entry
+        elif default:
+            return default[0]
+        else:
+            raise KeyError(key)
+
+    def popitem(self, last: bool = True) -> typ.Tuple[Key, Entry]:
+        if not self:
+            raise KeyError("dictionary is empty")
+        key = next(reversed(self)) if last else next(iter(self))
+        return (key, self.pop(key))
+
+    def clear(self) -> None:
+        collections.OrderedDict.clear(self)
+        self._keys_by_group.clear()
+        self._norm_strs_by_key.clear()
+
+    def candidate_keys(self, search_key: Key) -> typ.Tuple[Key, ...]:
+        """Keys with the same (msgid, path, symbol) as search_key."""
+        return tuple(self._keys_by_group.get(_key_group(search_key), ()))
+
+    def norm_strs(self, key: Key) -> NormStrs:
+        """Normalized (msg_text, source_line) of a key in the catalog."""
+        return self._norm_strs_by_key[key]
 
 
 FUZZY_MATCH_MAX_EDIT_DISTANCE_ABS = 8
 FUZZY_MATCH_MAX_EDIT_DISTANCE_PCT = 20
 
 
-def _iter_candidate_keys(catalog: Catalog, search_key: Key) -> typ.Iterable[Key]:
-    for key in catalog.keys():
-        is_candidate = (
-            search_key.msgid      == key.msgid
-            and search_key.path   == key.path
-            and search_key.symbol == key.symbol
+def _bag_distance(query_counts: typ.Counter[str], choice: str) -> int:
+    """Lower bound for the Levenshtein distance between query and choice.
+
+    Each edit operation changes the character counts of a string by at
+    most one, so the edit distance is at least the number of characters
+    one string has in surplus of the other.
+    """
+    diff = query_counts.copy()
+    diff.subtract(choice)
+    surplus = sum(n for n in diff.values() if n > 0)
+    deficit = sum(-n for n in diff.values() if n < 0)
+    return max(surplus, deficit)
+
+
+# Mapping of candidate index -> edit distance
+EditDistances = typ.Dict[int, int]
+
+
+def _edit_distances(query: str, choices: typ.List[str], max_dist: int) -> EditDistances:
+    """Levenshtein distance between query and each of the choices.
+
+    Only choices with a distance <= max_dist are included in the
+    result. With rapidfuzz all choices are scored in a single call,
+    which stops early for any choice that exceeds max_dist.
+    """
+    # The edit distance is at least the difference in length, so
+    # choices which differ too much in length are skipped without
+    # computing the edit distance at all.
+    query_len   = len(query)
+    choice_idxs = [
+        idx for idx, choice in enumerate(choices) if abs(len(choice) - query_len) <= max_dist
+    ]
+    if not choice_idxs:
+        return {}
+
+    if not HAS_RAPIDFUZZ:
+        # NOTE: pylev is pure python, so it's worth doing a cheap check
+        #   before computing the full edit distance.
+        query_counts = collections.Counter(query)
+        dists        = {}
+        for idx in choice_idxs:
+            if _bag_distance(query_counts, choices[idx]) > max_dist:
+                continue
+            dist = pylev.levenshtein(query, choices[idx])
+            if dist <= max_dist:
+                dists[idx] = dist
+        return dists
+    else:
+        matches = _rf_process.extract(
+            query,
+            [choices[idx] for idx in choice_idxs],
+            scorer=_rf_levenshtein.distance,
+            # NOTE: Punctuation and case are significant, so the strings
+            #   must not be preprocessed (rapidfuzz<3.0 did so by default).
+            processor=None,
+            score_cutoff=max_dist,
+            limit=None,
         )
-        if is_candidate:
-            yield key
+        return {choice_idxs[match_idx]: int(dist) for _, dist, match_idx in matches}
 
 
 def _iter_fuzzy_entries(catalog: Catalog, search_key: Key) -> typ.Iterable[Entry]:
-    for key in _iter_candidate_keys(catalog, search_key):
-        msg_text_dist = pylev.levenshtein(key.msg_text   , search_key.msg_text)
-        src_line_dist = pylev.levenshtein(key.source_line, search_key.source_line)
+    candidate_keys = catalog.candidate_keys(search_key)
+    if not candidate_keys:
+        return
 
-        if msg_text_dist > FUZZY_MATCH_MAX_EDIT_DISTANCE_ABS:
-            continue
-        if src_line_dist > FUZZY_MATCH_MAX_EDIT_DISTANCE_ABS:
+    search_msg_text, search_src_line = _norm_strs(search_key)
+
+    max_dist            = FUZZY_MATCH_MAX_EDIT_DISTANCE_ABS
+    candidate_norm_strs = [catalog.norm_strs(key) for key in candidate_keys]
+
+    msg_texts      = [msg_text for msg_text, _ in candidate_norm_strs]
+    msg_text_dists = _edit_distances(search_msg_text, msg_texts, max_dist)
+    if not msg_text_dists:
+        return
+
+    src_lines      = [src_line for _, src_line in candidate_norm_strs]
+    src_line_dists = _edit_distances(search_src_line, src_lines, max_dist)
+
+    for idx, key in enumerate(candidate_keys):
+        if idx not in msg_text_dists or idx not in src_line_dists:
             continue
 
-        msg_text_dist_pct = 100 * msg_text_dist / max(len(key.msg_text), len(search_key.msg_text))
-        src_line_dist_pct = (
-            100 * src_line_dist / max(len(key.source_line), len(search_key.source_line))
-        )
+        msg_text_dist = msg_text_dists[idx]
+        src_line_dist = src_line_dists[idx]
+
+        # NOTE: max(..., 1) as both strings may be empty after normalization
+        msg_text_len = max(len(msg_texts[idx]), len(search_msg_text), 1)
+        src_line_len = max(len(src_lines[idx]), len(search_src_line), 1)
+
+        msg_text_dist_pct = 100 * msg_text_dist / msg_text_len
+        src_line_dist_pct = 100 * src_line_dist / src_line_len
 
         if msg_text_dist_pct > FUZZY_MATCH_MAX_EDIT_DISTANCE_PCT:
             continue
@@ -193,10 +467,11 @@ def _iter_fuzzy_entries(catalog: Catalog, search_key: Key) -> typ.Iterable[Entry
 
 
 def find_entry(catalog: Catalog, search_key: Key) -> typ.Optional[Entry]:
-    has_exact_match = search_key in catalog
-    if has_exact_match:
-        # exact match
-        return catalog[search_key]
+    # NOTE: A single lookup, rather than "in" followed by "[]",
+    #   so the key is only hashed and compared once.
+    exact_match: typ.Optional[Entry] = catalog.get(search_key)
+    if exact_match is not None:
+        return exact_match
 
     # try for a fuzzy match
     matches = list(_iter_fuzzy_entries(catalog, search_key))
@@ -209,22 +484,128 @@ def find_entry(catalog: Catalog, search_key: Key) -> typ.Optional[Entry]:
 CONTEXT_LINES = 2
 
 
-_SRC_CACHE: typ.Dict[str, typ.List[str]] = {}
+class SourceFile(typ.NamedTuple):
+
+    text : str
+    lines: SourceLines
+
+    # lines with trailing whitespace removed, for comparison with source lines
+    stripped_lines: SourceLines
+
+    # Offset of each line in text, with len(text) as the last
+    # element, so that lines[i] == text[line_offsets[i]:line_offsets[i + 1]]
+    line_offsets: typ.Sequence[int]
+
+    # Indentation of each line, -1 for blank lines
+    indent_lvls: typ.Sequence[int]
+
+
+def _line_offsets(lines: SourceLines) -> typ.Sequence[int]:
+    offsets = array.array('l', [0])
+    offset  = 0
+    for line in lines:
+        offset += len(line)
+        offsets.append(offset)
+    return offsets
+
+
+def _indent_lvls(lines: SourceLines) -> typ.Sequence[int]:
+    indent_lvls = array.array('l')
+    for line in lines:
+        stripped_line = line.lstrip()
+        if stripped_line:
+            indent_lvls.append(len(line) - len(stripped_line))
+        else:
+            indent_lvls.append(-1)
+    return indent_lvls
+
+
+SRC_CACHE_MAXSIZE = 128
+
+# NOTE: Entries are ordered from least to most recently used.
+_SRC_CACHE: "collections.OrderedDict[str, SourceFile]" = collections.OrderedDict()
+
+
+def _read_source_file(path: str) -> SourceFile:
+    with pl.Path(path).open(mode="r", encoding="utf-8") as fobj:
+        full_src_text = fobj.read()
+
+    _keepends = True
+    lines     = tuple(full_src_text.splitlines(_keepends))
+    return SourceFile(
+        full_src_text,
+        lines,
+        tuple(line.rstrip() for line in lines),
+        _line_offsets(lines),
+        _indent_lvls(lines),
+    )
+
+
+def read_source_file(path: str) -> SourceFile:
+    srcfile = _SRC_CACHE.pop(path, None)
+    if srcfile is None:
+        srcfile = _read_source_file(path)
+        if len(_SRC_CACHE) >= SRC_CACHE_MAXSIZE:
+            _SRC_CACHE.popitem(last=False)
+
+    _SRC_CACHE[path] = srcfile
+    return srcfile
 
 
-def read_source_lines(path: str) -> typ.List[str]:
-    if path not in _SRC_CACHE:
-        if len(_SRC_CACHE) > 2:
-            _SRC_CACHE.popitem()
+def read_source_lines(path: str) -> SourceLines:
+    return read_source_file(path).lines
 
-        with pl.Path(path).open(mode="r", encoding="utf-8") as fobj:
-            full_src_text = fobj.read()
 
-        _keepends = True
-        lines     = full_src_text.splitlines(_keepends)
-        _SRC_CACHE[path] = lines
+# Maximum distance (in lines) between the old and new location of a source line
+MAX_LINENO_OFFSET = 100
 
-    return _SRC_CACHE[path]
+
+def _find_line_idx(srcfile: SourceFile, needle: str, old_line_idx: int) -> typ.Optional[int]:
+    """Find the line nearest to old_line_idx with line.rstrip() == needle.
+
+    Rather than comparing line by line, occurrences of needle are
+    searched for in the full text of the file, starting at old_line_idx
+    in both directions. Only lines with an occurrence are compared.
+    """
+    text           = srcfile.text
+    stripped_lines = srcfile.stripped_lines
+    offsets        = srcfile.line_offsets
+
+    hint_idx    = min(max(old_line_idx, 0), len(stripped_lines))
+    hint_offset = offsets[hint_idx]
+
+    # search forward, starting with the line at hint_idx
+    next_idx: typ.Optional[int] = None
+    start = text.find(needle, hint_offset)
+    while start >= 0:
+        line_idx = bisect.bisect_right(offsets, start) - 1
+        if line_idx - old_line_idx >= MAX_LINENO_OFFSET:
+            break
+        if stripped_lines[line_idx] == needle:
+            next_idx = line_idx
+            break
+        start = text.find(needle, offsets[line_idx + 1])
+
+    # search backward, starting with the line before hint_idx
+    prev_idx: typ.Optional[int] = None
+    start = text.rfind(needle, 0, hint_offset + len(needle) - 1)
+    while start >= 0:
+        line_idx = bisect.bisect_right(offsets, start) - 1
+        if old_line_idx - line_idx >= MAX_LINENO_OFFSET:
+            break
+        if stripped_lines[line_idx] == needle:
+            prev_idx = line_idx
+            break
+        start = text.rfind(needle, 0, offsets[line_idx] + len(needle) - 1)
+
+    if prev_idx is None:
+        return next_idx
+    elif next_idx is None:
+        return prev_idx
+    elif next_idx - old_line_idx < old_line_idx - prev_idx:
+        return next_idx
+    else:
+        return prev_idx
 
 
 def find_source_text_lineno(path: str, old_source_line: str, old_lineno: int) -> int:
@@ -232,45 +613,56 @@ def find_source_text_lineno(path: str, old_source_line: str, old_lineno: int) ->
         raise ObsoleteEntry("file not found")
 
     old_line_idx = old_lineno - 1
-    lines        = read_source_lines(path)
+    srcfile      = read_source_file(path)
+    needle       = old_source_line.rstrip()
 
     # NOTE (mb 2020-07-17): It's not too critical that we find the original
     #       entry. If we don't (and the message is still valid) then it will
     #       just be replaced by a new entry which will have to be acknowledged
     #       again. The git diff should make very obvious what happened.
 
-    for offset in range(100):
-        for line_idx in {old_line_idx - offset, old_line_idx + offset}:
-            is_matching_line = (
-                0 <= line_idx < len(lines) and lines[line_idx].rstrip() == old_source_line.rstrip()
-            )
-            if is_matching_line:
+    if needle:
+        line_idx = _find_line_idx(srcfile, needle, old_line_idx)
+        if line_idx is None:
+            raise ObsoleteEntry("source text not found")
+        return line_idx + 1
+
+    # NOTE: A blank line can't be searched for in the full text.
+    stripped_lines = srcfile.stripped_lines
+    num_lines      = len(stripped_lines)
+    for offset in range(MAX_LINENO_OFFSET):
+        for line_idx in (old_line_idx - offset, old_line_idx + offset):
+            if 0 <= line_idx < num_lines and stripped_lines[line_idx] == needle:
                 return line_idx + 1
+            if offset == 0:
+                break
 
     raise ObsoleteEntry("source text not found")
 
 
 def read_source_text(path: str, new_lineno: int, old_lineno: int) -> SourceText:
-    lines           = read_source_lines(path)
+    srcfile         = read_source_file(path)
+    lines           = srcfile.lines
     line_idx        = new_lineno - 1  # lineno starts at 1
     line_indent_lvl = len(lines[line_idx]) - len(lines[line_idx].lstrip())
 
     start_idx = max(0, line_idx - CONTEXT_LINES)
     end_idx   = min(len(lines), line_idx + CONTEXT_LINES + 1)
-    src_lines = lines[start_idx:end_idx]
-    src_text  = "".join(src_lines)
+    offsets   = srcfile.line_offsets
+    src_text  = srcfile.text[offsets[start_idx]:offsets[end_idx]]
+    src_lines = tuple(line.splitlines()[0] for line in lines[start_idx:end_idx])
 
     source_line = lines[line_idx]
     def_line_idx: typ.Optional[int] = None
     def_line    : typ.Optional[str] = None
 
+    indent_lvls   = srcfile.indent_lvls
     maybe_def_idx = line_idx
 
     while maybe_def_idx > 0:
-        line_text  = lines[maybe_def_idx]
-        indent_lvl = len(line_text) - len(line_text.lstrip())
-        if line_text.strip() and indent_lvl < line_indent_lvl:
-            first_token = line_text.lstrip().split()[0]
+        # NOTE: blank lines have an indent_lvl of -1 and are skipped
+        if 0 <= indent_lvls[maybe_def_idx] < line_indent_lvl:
+            first_token = lines[maybe_def_idx].split(None, 1)[0]
             if first_token in ('def', 'class'):
                 is_defline_before_ctx_src = 0 <= maybe_def_idx < start_idx
                 if is_defline_before_ctx_src:
@@ -281,7 +673,15 @@ def read_source_text(path: str, new_lineno: int, old_lineno: int) -> SourceText:
         maybe_def_idx -= 1
 
     return SourceText(
-        new_lineno, old_lineno, source_line, src_text, start_idx, end_idx, def_line_idx, def_line
+        new_lineno,
+        old_lineno,
+        source_line,
+        src_text,
+        src_lines,
+        start_idx,
+        end_idx,
+        def_line_idx,
+        def_line,
     )
 
 
@@ -291,16 +691,16 @@ EntryValues = typ.Dict[str, str]
 def _init_entry_item(entry_vals: EntryValues) -> typ.Tuple[Key, Entry]:
     msg_extra: str = ""
     if 'ctx_src_text' in entry_vals:
-        old_ctx_src_text      = entry_vals['ctx_src_text']
-        old_source_text_match = SOURCE_TEXT_RE.match(old_ctx_src_text)
-        if old_source_text_match is None:
+        old_ctx_src_text   = entry_vals['ctx_src_text']
+        old_ctx_src_fields = _parse_ctx_src_text_fields(old_ctx_src_text)
+        if old_ctx_src_fields is None:
             old_source_line = ""
             msg_extra       = old_ctx_src_text.strip()[3:][:-3].strip()
         else:
             # NOTE (mb 2020-07-16): The file may have changed in the meantime,
             #    so we search for the original source text (which may be on a
             #    different line).
-            old_source_line = old_source_text_match.group('source_line')
+            old_source_line = old_ctx_src_fields['source_line']
     else:
         old_source_line = ""
 
@@ -365,15 +765,18 @@ def dumps_entry(entry: Entry) -> str:
             if def_lineno + CONTEXT_LINES < srctxt.new_lineno:
                 src_lines.append("  ...")
 
-        for offset, line in enumerate(srctxt.text.splitlines()):
-            src_lineno = str(srctxt.start_idx + offset + 1)
+        line_fmt = f"  {{:>{padding_size}}}:{{}}".format
+
+        src_line_idx = len(src_lines) + srctxt.new_lineno - srctxt.start_idx - 1
+
+        for src_lineno, line in enumerate(srctxt.src_lines, srctxt.start_idx + 1):
             # padded_line is to avoid trailing whitespace
             padded_line = " " + line if line.strip() else ""
-            if lineno == src_lineno:
-                dumps_line = f"> {src_lineno:>{padding_size}}:{padded_line}"
-            else:
-                dumps_line = f"  {src_lineno:>{padding_size}}:{padded_line}"
-            src_lines.append(dumps_line)
+            src_lines.append(line_fmt(src_lineno, padded_line))
+
+        if src_line_idx < len(src_lines):
+            # mark the line the message refers to
+            src_lines[src_line_idx] = ">" + src_lines[src_line_idx][1:]
 
         msg_text     = entry.msg_text
         ctx_src_text = "\n".join(src_lines)
@@ -388,51 +791,55 @@ def dumps_entry(entry: Entry) -> str:
     return entry_text.lstrip("\n")
 
 
-def _parse_ctx_src_text(fence: str, lines: typ.Iterator[typ.Tuple[int, str]]) -> str:
-    ctx_src_text_lines = [fence + "\n"]
-    while True:
-        # consume lines to next fence
-        _, next_line = next(lines)
-        ctx_src_text_lines.append(next_line)
-        is_close_fence = next_line.strip() == fence
-        if is_close_fence:
-            break
-    return "".join(ctx_src_text_lines)
+def _find_close_fence(fence: str, lines: typ.List[str], open_idx: int) -> typ.Optional[int]:
+    for line_idx in range(open_idx + 1, len(lines)):
+        if lines[line_idx].strip() == fence:
+            return line_idx
+    return None
 
 
 def _iter_entry_values(ignorefile_path: pl.Path) -> typ.Iterable[EntryValues]:
     entry_vals: EntryValues = {}
 
+    # NOTE: readlines splits the same way as iterating over fobj would,
+    #   (unlike str.splitlines, which also splits on "\x0c" etc.).
     with ignorefile_path.open(mode="r", encoding="utf-8") as fobj:
-        lines = iter(enumerate(fobj))
-        try:
-            while True:
-                i, line = next(lines)
-                ignorefile_lineno = i + 1
-
-                if line.startswith("```"):
-                    fence = line[:3]
-                    entry_vals['ctx_src_text'] = _parse_ctx_src_text(fence, lines)
-                    continue
-
-                entry_header = ENTRY_HEADER_RE.match(line)
-                if entry_header and 'msgid' in entry_vals:
-                    # new header -> any existing entry is done
-                    yield entry_vals
-                    # new entry
-                    entry_vals = {}
-
-                if entry_header:
-                    entry_vals['ignorefile_lineno'] = str(ignorefile_lineno)
-                    entry_vals.update(entry_header.groupdict())
-                    assert 'msgid' in entry_vals
-                    continue
-
-                list_item = LIST_ITEM_RE.match(line)
-                if list_item:
-                    entry_vals[list_item.group('key')] = list_item.group('value')
-        except StopIteration:
-            pass
+        lines = fobj.readlines()
+
+    line_idx = 0
+    while line_idx < len(lines):
+        line              = lines[line_idx]
+        ignorefile_lineno = line_idx + 1
+        line_idx += 1
+
+        if line.startswith("```"):
+            fence     = line[:3]
+            close_idx = _find_close_fence(fence, lines, ignorefile_lineno - 1)
+            if close_idx is None:
+                # code block is never closed, ignore the rest of the file
+                break
+
+            entry_vals['ctx_src_text'] = fence + "\n" + "".join(lines[line_idx : close_idx + 1])
+            line_idx = close_idx + 1
+            continue
+
+        entry_header = ENTRY_HEADER_RE.match(line)
+        if entry_header and 'msgid' in entry_vals:
+            # new header -> any existing entry is done
+            yield entry_vals
+            # new entry
+            entry_vals = {}
+
+        if entry_header:
+            entry_vals['ignorefile_lineno'] = str(ignorefile_lineno)
+            entry_vals.update(entry_header.groupdict(""))
+            assert 'msgid' in entry_vals
+            continue
+
+        list_item = _parse_list_item(line)
+        if list_item:
+            key, value = list_item
+            entry_vals[key] = value
 
     # yield last entry (not followed by a header that would otherwise trigger the yield)
     if 'msgid' in entry_vals:
@@ -462,67 +869,89 @@ def _entry_priority(entry: Entry) -> typ.Any:
     )
 
 
-def dumps(ignorefile: Catalog) -> str:
+def _write_catalog(fobj: typ.TextIO, ignorefile: Catalog) -> None:
+    fobj.write(IGNOREFILE_HEADER)
     if len(ignorefile) == 0:
-        return IGNOREFILE_HEADER
+        return
 
     entries     = sorted(ignorefile.values(), key=_entry_priority)
     msgid_count = collections.Counter(e.msgid for e in entries)
 
-    overview_chunks: typ.List[str] = [IGNOREFILE_HEADER, "\n# Overview\n\n"]
-    entry_chunks   : typ.List[str] = []
+    # the first entry of each msgid starts a new section
+    section_entries = [
+        entry for i, entry in enumerate(entries) if i == 0 or entry.msgid != entries[i - 1].msgid
+    ]
+
+    fobj.write("\n# Overview\n\n")
+    for entry in section_entries:
+        num_entries  = msgid_count[entry.msgid]
+        section_text = f"{entry.msgid}: {entry.symbol} ({num_entries}x)"
+        entry_link   = f"#{entry.msgid}-{entry.symbol}".lower()
+        fobj.write(f" - [{section_text}]({entry_link})\n")
+    fobj.write("\n\n")
 
     prev_msg_id = None
     for entry in entries:
         if entry.msgid != prev_msg_id:
             prev_msg_id = entry.msgid
+            fobj.write(f"# {entry.msgid}: {entry.symbol}\n\n")
 
-            num_entries  = msgid_count[entry.msgid]
-            section_text = f"{entry.msgid}: {entry.symbol} ({num_entries}x)"
-            entry_link   = f"#{entry.msgid}-{entry.symbol}".lower()
-
-            section = f" - [{section_text}]({entry_link})\n"
-            overview_chunks.append(section)
-
-            entry_chunks.append(f"# {entry.msgid}: {entry.symbol}\n\n")
-
-        entry_chunks.append(dumps_entry(entry))
+        fobj.write(dumps_entry(entry))
 
-    overview_chunks.append("\n\n")
 
-    chunks = overview_chunks + entry_chunks
-
-    return "".join(chunks)
+def dumps(ignorefile: Catalog) -> str:
+    buf = io.StringIO()
+    _write_catalog(buf, ignorefile)
+    return buf.getvalue()
 
 
 def dump(ignorefile: Catalog, ignorefile_path: pl.Path) -> None:
-    ignorefile_text = dumps(ignorefile)
-    tmp_path        = ignorefile_path.parent / (ignorefile_path.name + ".tmp")
-    with tmp_path.open(mode="w", encoding="utf-8") as fobj:
-        fobj.write(ignorefile_text)
-    shutil.move(str(tmp_path), str(ignorefile_path))
+    tmp_path = ignorefile_path.parent / (ignorefile_path.name + ".tmp")
+    try:
+        with tmp_path.open(mode="w", encoding="utf-8") as fobj:
+            _write_catalog(fobj, ignorefile)
+    except BaseException:
+        # NOTE: Entries are formatted while the file is written,
+        #   so don't leave a partially written file behind.
+        tmp_path.unlink()
+        raise
+
+    # NOTE: tmp_path is in the same directory as ignorefile_path, so
+    #   this is an atomic rename.
+    if hasattr(os, 'replace'):
+        os.replace(str(tmp_path), str(ignorefile_path))
+    else:
+        # compat for python 2.7
+        shutil.move(str(tmp_path), str(ignorefile_path))
+
+
+def _init_entry_item_safe(entry_vals: EntryValues) -> typ.Optional[typ.Tuple[Key, Entry]]:
+    try:
+        return _init_entry_item(entry_vals)
+    except ObsoleteEntry:
+        # NOTE (mb 2020-07-17): It is fine for an entry to be obsolete.
+        #   The code may have improved, it may have moved, in any case
+        #   the ignore file is under version control and the change
+        #   will be seen.
+        return None
+    except (KeyError, ValueError) as ex:
+        lineno = entry_vals['ignorefile_lineno']
+        path   = entry_vals['path']
+        logmsg = f"Error parsing entry on line {lineno} of {path}: {ex}"
+        logger.error(logmsg, exc_info=True)
+        return None
 
 
 def load(ignorefile_path: pl.Path) -> Catalog:
     if not ignorefile_path.exists():
-        return {}
+        return Catalog()
 
-    catalog: Catalog = collections.OrderedDict()
+    catalog = Catalog()
     for entry_vals in _iter_entry_values(ignorefile_path):
-        try:
-            ignorefile_key, ignorefile_entry = _init_entry_item(entry_vals)
+        item = _init_entry_item_safe(entry_vals)
+        if item:
+            ignorefile_key, ignorefile_entry = item
             catalog[ignorefile_key] = ignorefile_entry
-        except ObsoleteEntry:
-            # NOTE (mb 2020-07-17): It is fine for an entry to be obsolete.
-            #   The code may have improved, it may have moved, in any case
-            #   the ignore file is under version control and the change
-            #   will be seen.
-            pass
-        except (KeyError, ValueError) as ex:
-            lineno = entry_vals['ignorefile_lineno']
-            path   = entry_vals['path']
-            logmsg = f"Error parsing entry on line {lineno} of {path}: {ex}"
-            logger.error(logmsg, exc_info=True)
 
     return catalog
 
@@ -537,7 +966,7 @@ def load_dir(dirpath: pl.Path) -> Catalog:
     We don't have to care about sorting here as that is done
     in the final write
     """
-    full_catalog: Catalog = {}
+    full_catalog = Catalog()
     for fpath in dirpath.glob("*.md"):
         partial_catalog = load(fpath)
         full_catalog.update(partial_catalog)
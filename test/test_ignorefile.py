@@ -11,6 +11,7 @@ import os
 import time
 import shutil
 import textwrap
+import collections
 
 import pytest
 import pathlib2 as pl
@@ -54,18 +55,18 @@ def test_regex_entry_header():
     assert matches == expected
 
 
-def test_regex_list_item():
-    maybe_matches = [ignorefile.LIST_ITEM_RE.match(case) for case in LINE_TEST_CASES]
-    matches       = [m.groupdict() for m in maybe_matches if m]
-    expected      = [
-        {'key': "message", 'value': "Too many instance attributes (10/7)"},
-        {'key': "author" , 'value': "Manuel Barkhau <mbarkhau@gmail.com>"},
-        {'key': "date"   , 'value': "2020-07-17T09:59:24"},
+def test_parse_list_item():
+    maybe_items = [ignorefile._parse_list_item(case) for case in LINE_TEST_CASES]
+    items       = [item for item in maybe_items if item]
+    expected    = [
+        ("message", "Too many instance attributes (10/7)"),
+        ("author" , "Manuel Barkhau <mbarkhau@gmail.com>"),
+        ("date"   , "2020-07-17T09:59:24"),
     ]
-    assert matches == expected
+    assert items == expected
 
 
-def test_regex_source_text_basic():
+def test_parse_ctx_src_text_basic():
     source_text = """
     ```
       89:
@@ -76,12 +77,12 @@ def test_regex_source_text_basic():
     ```
     """
     source_text = textwrap.dedent(source_text).strip()
-    match       = ignorefile.SOURCE_TEXT_RE.match(source_text)
-    assert match.group("source_lineno") == "91"
-    assert match.group("source_line"  ) == "class PylintIgnoreDecorator:"
+    fields      = ignorefile._parse_ctx_src_text_fields(source_text)
+    assert fields["source_lineno"] == "91"
+    assert fields["source_line"  ] == "class PylintIgnoreDecorator:"
 
 
-def test_regex_source_text_def_line():
+def test_parse_ctx_src_text_def_line():
     source_text = """
     ```
       124:     def _parse_args(self, args: typ.List[str]) -> None:
@@ -94,14 +95,14 @@ def test_regex_source_text_def_line():
     ```
     """
     source_text = textwrap.dedent(source_text).strip()
-    match       = ignorefile.SOURCE_TEXT_RE.match(source_text)
-    assert match.group("def_line"     ) == "    def _parse_args(self, args: typ.List[str]) -> None:"
-    assert match.group("def_lineno"   ) == "124"
-    assert match.group("source_line"  ) == "        # TODO (mb 2020-07-17): This will bla"
-    assert match.group("source_lineno") == "155"
+    fields      = ignorefile._parse_ctx_src_text_fields(source_text)
+    assert fields["def_line"     ] == "    def _parse_args(self, args: typ.List[str]) -> None:"
+    assert fields["def_lineno"   ] == "124"
+    assert fields["source_line"  ] == "        # TODO (mb 2020-07-17): This will bla"
+    assert fields["source_lineno"] == "155"
 
 
-def test_regex_source_text_edgecase():
+def test_parse_ctx_src_text_edgecase():
     source_text = '''
     ```
        96:
@@ -112,9 +113,37 @@ def test_regex_source_text_edgecase():
     ```
     '''
     source_text = textwrap.dedent(source_text.lstrip("\n").rstrip(" "))
-    match       = ignorefile.SOURCE_TEXT_RE.match(source_text)
-    assert match.group("source_line"  ) == "class PylintIgnoreDecorator:"
-    assert match.group("source_lineno") == "98"
+    fields      = ignorefile._parse_ctx_src_text_fields(source_text)
+    assert fields["source_line"  ] == "class PylintIgnoreDecorator:"
+    assert fields["source_lineno"] == "98"
+
+
+def test_parse_ctx_src_text_no_source_line():
+    source_text = """
+    ```
+    ==fixture_1:0
+    ==fixture_2:0
+    def function_redefined():
+        return 1
+    ```
+    """
+    source_text = textwrap.dedent(source_text).strip()
+    assert ignorefile._parse_ctx_src_text_fields(source_text) is None
+
+
+def test_bag_distance():
+    query_counts = collections.Counter("def function_redefined():")
+    assert ignorefile._bag_distance(query_counts, "def function_redefined():") == 0
+    assert ignorefile._bag_distance(query_counts, "def function_redefined(): ") == 1
+    assert ignorefile._bag_distance(query_counts, "def function_defined():") == 2
+    # lower bound only, the edit distance for this is 2
+    assert ignorefile._bag_distance(query_counts, "fed function_redefined():") == 0
+
+
+def test_edit_distances():
+    choices = ["x = foo[a]", "X = FOO(A)", "x = foo(a)", "y = bar(b, c, d)"]
+    dists   = ignorefile._edit_distances("x = foo(a)", choices, max_dist=3)
+    assert dists == {0: 2, 2: 0}
 
 
 def test_read_source_lines():
@@ -131,6 +160,22 @@ def test_read_source_lines():
     assert lines[6] == "def code_duplication():\n"
 
 
+def test_read_source_lines_lru(monkeypatch):
+    monkeypatch.setattr(ignorefile, 'SRC_CACHE_MAXSIZE', 2)
+    monkeypatch.setattr(ignorefile, '_SRC_CACHE', collections.OrderedDict())
+
+    fixture_2_path = str(FIXTURES_DIR / "fixture_2.py")
+    init_path      = str(FIXTURES_DIR / "__init__.py")
+
+    lines = ignorefile.read_source_lines(FIXTURE_FILE_PATH)
+    ignorefile.read_source_lines(fixture_2_path)
+    # access makes FIXTURE_FILE_PATH the most recently used
+    assert ignorefile.read_source_lines(FIXTURE_FILE_PATH) is lines
+    ignorefile.read_source_lines(init_path)
+
+    assert list(ignorefile._SRC_CACHE.keys()) == [FIXTURE_FILE_PATH, init_path]
+
+
 def test_read_source_text():
     srctxt = ignorefile.read_source_text(FIXTURE_FILE_PATH, 4, 7)
     assert srctxt.def_line_idx is None
@@ -146,6 +191,7 @@ def test_read_source_text():
     """
     expected_text = textwrap.dedent(expected_text).lstrip("\n")
     assert srctxt.text.startswith(expected_text)
+    assert srctxt.src_lines == tuple(srctxt.text.splitlines())
 
 
 def test_find_source_text_lineno():
@@ -159,6 +205,28 @@ def test_find_source_text_lineno():
     assert lineno == 7
 
 
+def test_find_source_text_lineno_nearest(tmpdir):
+    src_path = str(tmpdir / "nearest.py")
+    with pl.Path(src_path).open(mode="w", encoding="utf-8") as fobj:
+        # line 2 has a form feed, which splitlines treats as a line separator
+        fobj.write("x = 1\n\x0c\nx = 1  \ny = 2\n\n\nx = 1\n")
+
+    assert ignorefile.read_source_lines(src_path)[3] == "x = 1  \n"
+
+    assert ignorefile.find_source_text_lineno(src_path, "x = 1\n", 1) == 1
+    assert ignorefile.find_source_text_lineno(src_path, "x = 1\n", 3) == 4
+    assert ignorefile.find_source_text_lineno(src_path, "x = 1\n", 7) == 8
+    assert ignorefile.find_source_text_lineno(src_path, "x = 1\n", 9) == 8
+    assert ignorefile.find_source_text_lineno(src_path, "y = 2\n", 1) == 5
+    assert ignorefile.find_source_text_lineno(src_path, "\n", 7) == 7
+
+    with pytest.raises(ignorefile.ObsoleteEntry):
+        ignorefile.find_source_text_lineno(src_path, "y = 3\n", 5)
+
+    with pytest.raises(ignorefile.ObsoleteEntry):
+        ignorefile.find_source_text_lineno(src_path, "x = 1\n", 500)
+
+
 TEST_IGNOREFILE_TEXT = """
 
 # E0102: function-redefined
@@ -261,7 +329,7 @@ def test_iter_entry_values(tmp_ignorefile):
         },
         {
             'path'  : "fixtures/fixture_2.py",
-            'lineno': None,
+            'lineno': "",
             'msgid' : "R0801",
             'symbol': "duplicate-code",
             'author': "Manuel Barkhau <mbarkhau@gmail.com>",
@@ -328,6 +396,7 @@ def test_dump(tmp_ignorefile):
     out_file = pl.Path(str(tmpdir)) / "pylint-ignore-output.md"
 
     ignorefile.dump(in_catalog, out_file)
+    assert not (out_file.parent / (out_file.name + ".tmp")).exists()
 
     with out_file.open() as fobj:
         catalog_text = fobj.read()
@@ -355,12 +424,27 @@ def test_dump(tmp_ignorefile):
         # assert in_entry.srctxt.old_lineno   == out_entry.srctxt.old_lineno
         assert in_entry.srctxt.source_line  == out_entry.srctxt.source_line
         assert in_entry.srctxt.text         == out_entry.srctxt.text
+        assert in_entry.srctxt.src_lines    == out_entry.srctxt.src_lines
         assert in_entry.srctxt.start_idx    == out_entry.srctxt.start_idx
         assert in_entry.srctxt.end_idx      == out_entry.srctxt.end_idx
         assert in_entry.srctxt.def_line_idx == out_entry.srctxt.def_line_idx
         assert in_entry.srctxt.def_line     == out_entry.srctxt.def_line
 
 
+def test_dump_error(tmp_ignorefile):
+    in_catalog = ignorefile.load(tmp_ignorefile)
+    out_file   = tmp_ignorefile.parent / "pylint-ignore-output.md"
+
+    # an invalid entry, which fails after the first entries were written
+    key, entry      = list(in_catalog.items())[-1]
+    in_catalog[key] = entry._replace(msg_text=None)
+    with pytest.raises(TypeError):
+        ignorefile.dump(in_catalog, out_file)
+
+    assert not out_file.exists()
+    assert not (out_file.parent / (out_file.name + ".tmp")).exists()
+
+
 def test_find_entry(tmp_ignorefile):
     _catalog = ignorefile.load(tmp_ignorefile)
     for key, entry in _catalog.items():
@@ -375,3 +459,46 @@ def test_find_entry(tmp_ignorefile):
         )
 
         assert ignorefile.find_entry(_catalog, fuzzy_key) is entry
+
+
+def test_catalog_candidate_keys(tmp_ignorefile):
+    _catalog = ignorefile.load(tmp_ignorefile)
+    keys     = list(_catalog.keys())
+    entries  = list(_catalog.values())
+
+    fuzzy_key = keys[0]._replace(msg_text="function already defined line 2")
+    assert _catalog.candidate_keys(fuzzy_key) == (keys[0],)
+
+    other_key = keys[0]._replace(symbol="invalid-symbol")
+    assert _catalog.candidate_keys(other_key) == ()
+
+    del _catalog[keys[0]]
+    assert _catalog.candidate_keys(fuzzy_key) == ()
+
+    assert _catalog.pop(keys[1]) is entries[1]
+    assert _catalog.pop(keys[1], None) is None
+    with pytest.raises(KeyError):
+        _catalog.pop(keys[1])
+
+    assert len(_catalog) == 1
+    assert _catalog == {keys[2]: entries[2]}
+    assert _catalog.norm_strs(keys[2]) == (keys[2].msg_text.strip(), keys[2].source_line.rstrip())
+
+    assert _catalog.popitem() == (keys[2], entries[2])
+    assert _catalog.candidate_keys(keys[2]) == ()
+    with pytest.raises(KeyError):
+        _catalog.popitem()
+
+    _catalog.update(zip(keys, entries))
+    assert _catalog.popitem(last=False) == (keys[0], entries[0])
+    _catalog.clear()
+    assert all(_catalog.candidate_keys(key) == () for key in keys)
+
+
+def test_find_entry_normalized(tmp_ignorefile):
+    _catalog = ignorefile.load(tmp_ignorefile)
+    for key, entry in _catalog.items():
+        padded_key = key._replace(
+            msg_text=" " + key.msg_text + " \n", source_line=key.source_line + "  \n"
+        )
+        assert ignorefile.find_entry(_catalog, padded_key) is entry